@@ -2,16 +2,29 @@ import telebot
 import pandas as pd
 import html
 import os
+import io
+import re
+import csv
 import json
+import math
+import heapq
 import time
+import random
+import threading
+import queue
+import uuid
+import atexit
+import requests
+from telebot import apihelper
 from telegram_bot_calendar import DetailedTelegramCalendar
-from collections import Counter
+from collections import Counter, OrderedDict
 from zoneinfo import ZoneInfo
 from datetime import datetime, timedelta
 from telebot.types import ReplyKeyboardMarkup, KeyboardButton
+from telebot.handler_backends import BaseMiddleware, CancelUpdate
 
 TOKEN = os.getenv("BOT_TOKEN")
-bot = telebot.TeleBot(TOKEN)
+bot = telebot.TeleBot(TOKEN, use_class_middlewares=True)
 
 BUTTONS = {
     "🔥 выставки на сегодня": "today",
@@ -21,9 +34,216 @@ BUTTONS = {
     "⭐ лучшие выставки месяца": "best_month",   # ← добавили
     "📅 выбрать дату": "pick_date",
     "🆓 бесплатные дни": "free_days_30",
+    "🗓 на выходные": "weekend",
 }
 
 
+# =======================
+# ЖУРНАЛ СОБЫТИЙ
+# =======================
+# Структурированные события (JSON, по строке на событие): запросы с request_id, пользователем,
+# хендлером, задержкой, состоянием кэша и числом вызовов API; обновления таблиц; ошибки.
+# Хендлер только кладёт событие в очередь — на диск пишет фоновый поток пачками,
+# файл ротируется по размеру. Через ту же очередь пишется запись апдейтов (UPDATES_LOG_PATH),
+# и этот же поток сохраняет stats.json.
+EVENTS_LOG_PATH = os.getenv("EVENTS_LOG_PATH", "events.jsonl")   # пустая строка — не писать
+EVENTS_LOG_MAX_BYTES = int(os.getenv("EVENTS_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+EVENTS_LOG_BACKUPS = max(1, int(os.getenv("EVENTS_LOG_BACKUPS", "3")))
+EVENTS_QUEUE_SIZE = 10000
+EVENTS_BATCH_SIZE = 500
+STATS_SAVE_INTERVAL = 5.0  # секунд
+
+_events = queue.Queue(maxsize=EVENTS_QUEUE_SIZE)   # (файл, его лимит размера, запись)
+_events_dropped = 0
+_event_local = threading.local()
+_writer_lock = threading.Lock()   # один писатель: фоновый поток или финальный сброс при выходе
+_SHEET_ERROR_LABELS = {"exhibitions": "DATA", "free_days": "FREE DAYS"}
+
+
+def log_event(event: str, **fields):
+    """Не блокирует: если очередь переполнена, событие теряется (и считается)."""
+    record = {"ts": round(time.time(), 3), "event": event}
+    ctx = getattr(_event_local, "ctx", None)
+    if ctx is not None and "request_id" not in fields:
+        record["request_id"] = ctx["request_id"]
+    record.update(fields)
+
+    if not EVENTS_LOG_PATH:
+        # журнал выключен — ошибки всё равно печатаем, как раньше
+        if event == "error":
+            print(f"{fields.get('source', '')} error:", fields.get("error"))
+        elif event == "sheet_error":
+            label = _SHEET_ERROR_LABELS.get(fields.get("dataset"), fields.get("dataset"))
+            print(f"{label} load error:", fields.get("error"))
+        return
+
+    enqueue_log_record(EVENTS_LOG_PATH, EVENTS_LOG_MAX_BYTES, record)
+
+
+def enqueue_log_record(path, max_bytes, record):
+    """Запись в JSONL-файл через фоновый писатель. Не блокирует; при переполнении теряется."""
+    global _events_dropped
+    try:
+        _events.put_nowait((path, max_bytes, record))
+    except queue.Full:
+        _events_dropped += 1
+
+
+def log_error(source: str, error):
+    log_event("error", source=source, error=f"{type(error).__name__}: {error}")
+
+
+# ----- контекст текущего запроса -----
+
+def begin_request_event(update_type, user_id, chat_id):
+    _event_local.ctx = {
+        "request_id": uuid.uuid4().hex[:12],
+        "started": time.perf_counter(),
+        "update": update_type,
+        "user": user_id,
+        "chat": chat_id,
+        "handler": None,
+        "api_calls": 0,
+        "data": None,       # выставки: fresh / refreshed / stale / breaker_open
+        "free_days": None,  # бесплатные дни: то же
+        "shared": Counter(),  # hit / miss / wait
+    }
+
+
+def finish_request_event(status="ok", error=None):
+    ctx = getattr(_event_local, "ctx", None)
+    if ctx is None:
+        return
+    _event_local.ctx = None
+
+    log_event(
+        "request",
+        request_id=ctx["request_id"],
+        update=ctx["update"],
+        user=ctx["user"],
+        chat=ctx["chat"],
+        handler=ctx["handler"],
+        status=status,
+        latency_ms=round((time.perf_counter() - ctx["started"]) * 1000, 1),
+        api_calls=ctx["api_calls"],
+        data=ctx["data"],
+        free_days=ctx["free_days"],
+        shared=dict(ctx["shared"]),
+        error=f"{type(error).__name__}: {error}" if error else None,
+    )
+
+
+def note_request(key, value=None):
+    """Отметка в контексте текущего запроса (вне запроса — ничего не делает)."""
+    ctx = getattr(_event_local, "ctx", None)
+    if ctx is None:
+        return
+    if key == "shared":
+        ctx["shared"][value] += 1
+    else:
+        ctx[key] = value
+
+
+_make_request = apihelper._make_request
+
+
+def _counting_make_request(*args, **kwargs):
+    ctx = getattr(_event_local, "ctx", None)
+    if ctx is not None:
+        ctx["api_calls"] += 1
+    return _make_request(*args, **kwargs)
+
+
+apihelper._make_request = _counting_make_request
+
+
+class EventLogMiddleware(BaseMiddleware):
+    def __init__(self):
+        self.update_sensitive = True
+        self.update_types = ["message", "callback_query"]
+
+    def pre_process_message(self, message, data):
+        begin_request_event("message", message.from_user.id, message.chat.id)
+        # команды без record_request подпишем именем команды
+        text = message.text or ""
+        note_request("handler", text.split()[0] if text.startswith("/") else None)
+
+    def post_process_message(self, message, data, exception):
+        finish_request_event("error" if exception else "ok", exception)
+
+    def pre_process_callback_query(self, call, data):
+        begin_request_event("callback_query", call.from_user.id, call.message.chat.id)
+
+    def post_process_callback_query(self, call, data, exception):
+        finish_request_event("error" if exception else "ok", exception)
+
+
+# ----- фоновый писатель -----
+
+def _rotate_log(path):
+    for i in range(EVENTS_LOG_BACKUPS - 1, 0, -1):
+        src = f"{path}.{i}"
+        if os.path.exists(src):
+            os.replace(src, f"{path}.{i + 1}")
+    os.replace(path, f"{path}.1")
+
+
+def _write_events(batch):
+    by_path = {}
+    for path, max_bytes, record in batch:
+        by_path.setdefault((path, max_bytes), []).append(record)
+
+    for (path, max_bytes), records in by_path.items():
+        try:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in records))
+                size = f.tell()
+            if size > max_bytes:
+                _rotate_log(path)
+        except Exception as e:
+            print("EVENTS write error:", e)
+
+
+def _drain_events(first=None):
+    batch = [] if first is None else [first]
+    while len(batch) < EVENTS_BATCH_SIZE:
+        try:
+            batch.append(_events.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def _event_writer_loop():
+    global _events_dropped
+    while True:
+        try:
+            first = _events.get(timeout=STATS_SAVE_INTERVAL)
+        except queue.Empty:
+            first = None
+
+        with _writer_lock:
+            batch = _drain_events(first)
+            if _events_dropped and EVENTS_LOG_PATH:
+                record = {"ts": round(time.time(), 3), "event": "events_dropped", "count": _events_dropped}
+                batch.append((EVENTS_LOG_PATH, EVENTS_LOG_MAX_BYTES, record))
+                _events_dropped = 0
+            _write_events(batch)
+            _flush_stats_if_dirty()
+
+
+def _flush_on_exit():
+    with _writer_lock:
+        while not _events.empty():
+            _write_events(_drain_events())
+        _flush_stats_if_dirty(force=True)
+
+
+def start_event_writer():
+    threading.Thread(target=_event_writer_loop, name="event-writer", daemon=True).start()
+    atexit.register(_flush_on_exit)
+
+
 # =======================
 # СТАТИСТИКА
 # =======================
@@ -43,6 +263,8 @@ DEFAULT_STATS = {
 
 _stats = DEFAULT_STATS.copy()
 _last_save_ts = 0
+_stats_dirty = False
+_stats_lock = threading.Lock()
 
 
 def _load_stats():
@@ -61,18 +283,38 @@ def _load_stats():
     except FileNotFoundError:
         _stats = DEFAULT_STATS.copy()
     except Exception as e:
-        print("STATS load error:", e)
+        log_error("STATS load", e)
         _stats = DEFAULT_STATS.copy()
 
 def _save_stats(force: bool = False):
-    global _last_save_ts
+    """
+    force=False — только пометить, что есть что сохранить: файл запишет фоновый поток
+    (не чаще раза в STATS_SAVE_INTERVAL), хендлер на диск не ходит.
+    force=True — записать сейчас; только из фонового писателя (под _writer_lock).
+    """
+    global _last_save_ts, _stats_dirty
+    if not force:
+        _stats_dirty = True
+        return
+
     now = time.time()
     _last_save_ts = now
     try:
-        with open(STATS_PATH, "w", encoding="utf-8") as f:
-            json.dump(_stats, f, ensure_ascii=False, indent=2)
+        with _stats_lock:
+            payload = json.dumps(_stats, ensure_ascii=False, indent=2)
+            _stats_dirty = False
+        # через временный файл: stats.json никогда не бывает записан наполовину
+        tmp_path = STATS_PATH + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_path, STATS_PATH)
     except Exception as e:
-        print("STATS save error:", e)
+        log_error("STATS save", e)
+
+
+def _flush_stats_if_dirty(force: bool = False):
+    if _stats_dirty and (force or time.time() - _last_save_ts >= STATS_SAVE_INTERVAL):
+        _save_stats(force=True)
 
 def record_request(user_id: int, date_str: str, source: str = "text"):
     today = time.strftime("%Y-%m-%d", time.localtime(time.time()))
@@ -83,28 +325,32 @@ def record_request(user_id: int, date_str: str, source: str = "text"):
     except Exception:
         pass
 
-    _stats["total_requests"] = int(_stats.get("total_requests", 0)) + 1
+    note_request("handler", source)
+
+    with _stats_lock:
+        _stats["total_requests"] = int(_stats.get("total_requests", 0)) + 1
 
-    # уникальные пользователи
-    if user_id not in set(_stats.get("unique_users", [])):
-        _stats.setdefault("unique_users", []).append(user_id)
+        # уникальные пользователи
+        if user_id not in set(_stats.get("unique_users", [])):
+            _stats.setdefault("unique_users", []).append(user_id)
 
-    # запросы по дням
-    rbd = _stats.setdefault("requests_by_day", {})
-    rbd[today] = int(rbd.get(today, 0)) + 1
+        # запросы по дням
+        rbd = _stats.setdefault("requests_by_day", {})
+        rbd[today] = int(rbd.get(today, 0)) + 1
 
-    # какие даты спрашивают
-    da = _stats.setdefault("dates_asked", {})
-    if date_str:
-        da[date_str] = int(da.get(date_str, 0)) + 1
+        # какие даты спрашивают
+        da = _stats.setdefault("dates_asked", {})
+        if date_str:
+            da[date_str] = int(da.get(date_str, 0)) + 1
 
-    # источник (кнопка/текст)
-    src = _stats.setdefault("sources", {})
-    src[source] = int(src.get(source, 0)) + 1
+        # источник (кнопка/текст)
+        src = _stats.setdefault("sources", {})
+        src[source] = int(src.get(source, 0)) + 1
 
-    _save_stats(force=True)
+    _save_stats()
 
 _load_stats()
+start_event_writer()  # после статистики: писатель заодно сохраняет stats.json
 
 @bot.message_handler(commands=["reset_stats"])
 def reset_stats_cmd(message):
@@ -113,12 +359,194 @@ def reset_stats_cmd(message):
         return
 
     global _stats
-    _stats = DEFAULT_STATS.copy()
-    _save_stats(force=True)
+    with _stats_lock:
+        _stats = DEFAULT_STATS.copy()
+    _save_stats()
 
     bot.reply_to(message, "Статистика сброшена ✅")
 
 
+# =======================
+# ЗАПИСЬ ВХОДЯЩИХ АПДЕЙТОВ
+# =======================
+# Если задан UPDATES_LOG_PATH — каждый входящий апдейт (текст, кнопка, календарь)
+# дописывается туда строкой JSON вместе со временем получения.
+# Пишет фоновый писатель журнала событий; файл ротируется по UPDATES_LOG_MAX_BYTES
+# (старые части — UPDATES_LOG_PATH.1, .2, …).
+# Потом этот файл можно проиграть заново через replay.py.
+UPDATES_LOG_PATH = os.getenv("UPDATES_LOG_PATH")
+UPDATES_LOG_MAX_BYTES = int(os.getenv("UPDATES_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+
+
+class UpdateRecorderMiddleware(BaseMiddleware):
+    def __init__(self):
+        self.update_sensitive = False
+        self.update_types = ["message", "callback_query"]
+
+    def pre_process(self, obj, data):
+        payload = obj.json
+        if isinstance(payload, str):
+            payload = json.loads(payload)
+
+        record = {
+            "ts": time.time(),
+            "type": "callback_query" if isinstance(obj, telebot.types.CallbackQuery) else "message",
+            "payload": payload,
+        }
+        enqueue_log_record(UPDATES_LOG_PATH, UPDATES_LOG_MAX_BYTES, record)
+
+    def post_process(self, obj, data, exception):
+        pass
+
+
+# журнал событий — первым, чтобы видеть и отброшенные запросы;
+# запись апдейтов — до защиты от флуда, чтобы в записи был весь реальный трафик
+bot.setup_middleware(EventLogMiddleware())
+if UPDATES_LOG_PATH:
+    bot.setup_middleware(UpdateRecorderMiddleware())
+
+
+# =======================
+# ЗАЩИТА ОТ ФЛУДА
+# =======================
+# token bucket на пользователя: RATE_LIMIT_BURST запросов подряд,
+# дальше — не чаще RATE_LIMIT_PER_MINUTE в минуту
+RATE_LIMIT_PER_MINUTE = max(1, int(os.getenv("RATE_LIMIT_PER_MINUTE", "20")))
+RATE_LIMIT_BURST = max(1, int(os.getenv("RATE_LIMIT_BURST", "5")))
+# повторное нажатие той же кнопки календаря в течение этого времени игнорируем
+CALLBACK_DEDUP_SECONDS = float(os.getenv("CALLBACK_DEDUP_SECONDS", "2"))
+
+_rate_lock = threading.Lock()
+_rate_buckets = {}       # user_id -> [tokens, last_ts, warned]
+_inflight = set()        # запросы, которые сейчас обрабатываются
+_recent_callbacks = {}   # (chat_id, message_id, data) -> ts
+
+
+def _take_token(user_id):
+    """
+    Возвращает (allowed, warn).
+    warn=True только для первого отказа подряд — чтобы не спамить предупреждениями.
+    """
+    now = time.monotonic()
+    rate = RATE_LIMIT_PER_MINUTE / 60.0
+
+    with _rate_lock:
+        # чистим давно неактивных пользователей (их ведро всё равно уже полное)
+        if len(_rate_buckets) > 10000:
+            idle = RATE_LIMIT_BURST / rate
+            for uid in [u for u, b in _rate_buckets.items() if now - b[1] > idle]:
+                del _rate_buckets[uid]
+
+        bucket = _rate_buckets.get(user_id)
+        if bucket is None:
+            bucket = _rate_buckets[user_id] = [float(RATE_LIMIT_BURST), now, False]
+
+        tokens = min(float(RATE_LIMIT_BURST), bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            bucket[2] = False
+            return True, False
+
+        bucket[0] = tokens
+        warn = not bucket[2]
+        bucket[2] = True
+        return False, warn
+
+
+def _begin_inflight(key) -> bool:
+    with _rate_lock:
+        if key in _inflight:
+            return False
+        _inflight.add(key)
+        return True
+
+
+def _end_inflight(key):
+    if key is None:
+        return
+    with _rate_lock:
+        _inflight.discard(key)
+
+
+def _is_duplicate_callback(key) -> bool:
+    now = time.monotonic()
+    with _rate_lock:
+        if len(_recent_callbacks) > 10000:
+            for k in [k for k, ts in _recent_callbacks.items() if now - ts > CALLBACK_DEDUP_SECONDS]:
+                del _recent_callbacks[k]
+
+        last = _recent_callbacks.get(key)
+        _recent_callbacks[key] = now
+        return last is not None and now - last < CALLBACK_DEDUP_SECONDS
+
+
+class FloodControlMiddleware(BaseMiddleware):
+    """
+    Срабатывает до любого хендлера:
+    - одинаковый запрос из того же чата, пока предыдущий ещё считается, — отбрасываем;
+    - повторные нажатия той же кнопки календаря — отбрасываем;
+    - всё остальное проходит через token bucket пользователя.
+    """
+
+    def __init__(self):
+        self.update_sensitive = True
+        self.update_types = ["message", "callback_query"]
+
+    def pre_process_message(self, message, data):
+        key = ("msg", message.chat.id, (message.text or message.content_type).strip().lower())
+        if not _begin_inflight(key):
+            finish_request_event("coalesced")
+            return CancelUpdate()
+
+        allowed, warn = _take_token(message.from_user.id)
+        if not allowed:
+            _end_inflight(key)
+            if warn:
+                try:
+                    bot.send_message(message.chat.id, "Слишком много запросов 🙈 Подождите немного и попробуйте снова.")
+                except Exception:
+                    pass
+            finish_request_event("rate_limited")
+            return CancelUpdate()
+
+        data["inflight_key"] = key
+
+    def post_process_message(self, message, data, exception):
+        _end_inflight(data.get("inflight_key"))
+
+    def pre_process_callback_query(self, call, data):
+        key = ("cb", call.message.chat.id, call.message.message_id, call.data)
+        if _is_duplicate_callback(key) or not _begin_inflight(key):
+            self._answer(call)
+            finish_request_event("coalesced")
+            return CancelUpdate()
+
+        allowed, warn = _take_token(call.from_user.id)
+        if not allowed:
+            _end_inflight(key)
+            self._answer(call, "Слишком много запросов, подождите немного ⏳" if warn else None)
+            finish_request_event("rate_limited")
+            return CancelUpdate()
+
+        data["inflight_key"] = key
+
+    def post_process_callback_query(self, call, data, exception):
+        _end_inflight(data.get("inflight_key"))
+
+    @staticmethod
+    def _answer(call, text=None):
+        # иначе у пользователя будут «часики» на кнопке
+        try:
+            bot.answer_callback_query(call.id, text)
+        except Exception:
+            pass
+
+
+bot.setup_middleware(FloodControlMiddleware())
+
+
 SHEETS_URL = os.getenv("SHEETS_CSV_URL")
 CSV_URL = os.getenv("SHEETS_CSV_URL")
 
@@ -128,17 +556,23 @@ def main_keyboard():
     kb.row(KeyboardButton("🔥 Выставки на сегодня"), KeyboardButton("📅 Выбрать дату"))
     kb.row(KeyboardButton("⏳ Заканчиваются скоро"), KeyboardButton("🆕 Новые выставки"))
     kb.row(KeyboardButton("⭐ Лучшие выставки месяца"), KeyboardButton("🆓 Бесплатные дни"))
+    kb.row(KeyboardButton("🗓 На выходные"), KeyboardButton("📍 Открыто рядом со мной", request_location=True))
     return kb
 
 
+def vienna_today():
+    """«Сегодня» для всех запросов — по Вене, а не по часам сервера."""
+    return datetime.now(TZ).date()
+
+
 def parse_date(text: str):
     t = text.strip().lower()
 
     if t in ("сегодня", "today"):
-        return datetime.today().date()
+        return vienna_today()
 
     if t in ("завтра", "tomorrow"):
-        return (datetime.today() + timedelta(days=1)).date()
+        return vienna_today() + timedelta(days=1)
 
     formats = ("%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y", "%d-%m-%Y")
     for fmt in formats:
@@ -149,6 +583,92 @@ def parse_date(text: str):
 
     return None
 
+# =======================
+# ПЕРИОДЫ: «12.03–20.03», «выходные», «следующая неделя»
+# =======================
+MAX_RANGE_DAYS = max(1, int(os.getenv("MAX_RANGE_DAYS", "31")))
+
+_WEEKEND_WORDS = {"выходные", "эти выходные", "на выходных", "на выходные", "weekend", "this weekend"}
+_THIS_WEEK_WORDS = {"эта неделя", "на этой неделе", "на неделю", "this week"}
+_NEXT_WEEK_WORDS = {"следующая неделя", "на следующей неделе", "на следующую неделю", "next week"}
+_BY_DAY_RE = re.compile(r"\s*(?:по дням|by day)\s*$")
+
+_DAY = r"\d{1,2}[./]\d{1,2}(?:[./]\d{2,4})?|\d{4}-\d{2}-\d{2}"
+_RANGE_RE = re.compile(
+    rf"^(?:с|from)?\s*({_DAY})\s*(?:–|—|-|по|до|to)\s*({_DAY})$"
+)
+
+
+def _parse_range_day(token, year):
+    """-> (дата, был ли указан год); без года в токене берём year"""
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y", "%d.%m.%y", "%d/%m/%y"):
+        try:
+            return datetime.strptime(token, fmt).date(), True
+        except ValueError:
+            continue
+    # год подставляем до разбора: без него strptime берёт 1900-й, и 29.02 не разбирается
+    for sep in (".", "/"):
+        try:
+            return datetime.strptime(f"{token}{sep}{year}", f"%d{sep}%m{sep}%Y").date(), False
+        except ValueError:
+            continue
+    return None, False
+
+
+def parse_date_range(text: str):
+    """
+    Период из текста -> (начало, конец, по_дням) или None.
+    Понимает «12.03–20.03», «с 12.03.2026 по 20.03.2026», «выходные», «эта/следующая неделя»
+    и суффикс «по дням».
+    """
+    t = text.strip().lower()
+    by_day = bool(_BY_DAY_RE.search(t))
+    t = _BY_DAY_RE.sub("", t).strip()
+    today = vienna_today()
+
+    if t in _WEEKEND_WORDS:
+        # в воскресенье «выходные» — это уже только сегодня
+        saturday = today + timedelta(days=(5 - today.weekday()) % 7)
+        if today.weekday() == 6:
+            saturday = today - timedelta(days=1)
+        return max(saturday, today), saturday + timedelta(days=1), by_day
+
+    if t in _THIS_WEEK_WORDS:
+        return today, today + timedelta(days=6 - today.weekday()), by_day
+
+    if t in _NEXT_WEEK_WORDS:
+        monday = today + timedelta(days=7 - today.weekday())
+        return monday, monday + timedelta(days=6), by_day
+
+    m = _RANGE_RE.match(t)
+    if not m:
+        return None
+
+    start, start_has_year = _parse_range_day(m.group(1), today.year)
+    if start is None:
+        return None
+    end, end_has_year = _parse_range_day(m.group(2), start.year)
+    if end is None:
+        return None
+
+    # «28.12–03.01» без года — конец уже в следующем году
+    # (разбираем заново, а не replace(): 29.02 есть не в каждом году)
+    if end < start and not end_has_year:
+        end, _ = _parse_range_day(m.group(2), start.year + 1)
+
+    # «12.03–20.03» в октябре — это март следующего года, а не прошедший
+    if end is not None and end < today and not start_has_year and not end_has_year:
+        next_start, _ = _parse_range_day(m.group(1), start.year + 1)
+        next_end, _ = _parse_range_day(m.group(2), end.year + 1)
+        if next_start is not None and next_end is not None:
+            start, end = next_start, next_end
+
+    if start is None or end is None or end < start:
+        return None
+
+    return start, end, by_day
+
+
 def format_date_russian(date_obj):
     months = [
         "января", "февраля", "марта", "апреля",
@@ -170,6 +690,9 @@ def format_date_ddmmyyyy(d):
     return d.strftime("%d.%m.%Y")
 
 
+WEEKDAYS_SHORT_RU = ["пн", "вт", "ср", "чт", "пт", "сб", "вс"]
+
+
 # --- cache for Google Sheets / CSV ---
 # Сколько минут держим данные в памяти (можно задать переменной окружения DATA_CACHE_MINUTES)
 CACHE_TTL_MINUTES = int(os.getenv("DATA_CACHE_MINUTES", "10"))
@@ -177,17 +700,462 @@ CACHE_TTL_SECONDS = max(5, CACHE_TTL_MINUTES * 60)  # защита от 0/отр
 
 _cache_df = None
 _cache_loaded_at = None
+_cache_lock = threading.Lock()
+
+# =======================
+# ОБЩИЕ РЕЗУЛЬТАТЫ
+# =======================
+# Одинаковые запросы разных пользователей (например, «сегодня») считаем один раз.
+# Каждый результат помнит, от какой таблицы и какого диапазона дат он зависит:
+# после обновления данных сбрасываются только те, которых коснулись изменения.
+_data_generation = {"exhibitions": 0, "free_days": 0}
+_shared_lock = threading.Lock()
+_shared_results = OrderedDict()   # key -> (dataset, span, value); в порядке последнего обращения
+_shared_pending = {}   # key -> threading.Event
+SHARED_RESULTS_MAX = 500  # вытесняются те, к которым дольше всего не обращались (LRU)
+
+
+def _spans_overlap(a, b):
+    return a[0] <= b[1] and b[0] <= a[1]
+
+
+def invalidate_shared(dataset, spans=None):
+    """
+    Сбрасывает результаты таблицы dataset, чей диапазон дат пересекается с любым из spans.
+    spans=None — сбросить все результаты этой таблицы.
+    """
+    with _shared_lock:
+        _data_generation[dataset] += 1
+        dropped = 0
+        for key, (ds, span, _) in list(_shared_results.items()):
+            if ds != dataset:
+                continue
+            if spans is None or span is None or any(_spans_overlap(span, s) for s in spans):
+                del _shared_results[key]
+                dropped += 1
+        return dropped
+
+
+def stamp_generation(dataset, df):
+    """
+    Помечает свежезагруженную таблицу текущим поколением данных.
+    Вызывать после invalidate_shared() и до того, как таблица станет видна хендлерам.
+    """
+    with _shared_lock:
+        df.attrs["generation"] = (dataset, _data_generation[dataset])
+
+
+def shared_result(key, df, compute, dataset="exhibitions", span=None):
+    """
+    Если результат для key уже есть — отдаём его.
+    Если его прямо сейчас считает другой поток — ждём и отдаём тот же результат.
+    Иначе считаем сами.
+
+    df — таблица, из которой считает compute(). Результат сохраняется, только если это
+    текущая версия таблицы: хендлер мог получить старую, пока другой поток её обновлял.
+
+    span=(from_date, to_date) — какие даты таблицы dataset влияют на результат
+    (None — любые).
+    """
+    generation = df.attrs.get("generation")
+
+    while True:
+        with _shared_lock:
+            if key in _shared_results:
+                note_request("shared", "hit")
+                _shared_results.move_to_end(key)
+                return _shared_results[key][2]
+            event = _shared_pending.get(key)
+            owner = event is None
+            if owner:
+                event = _shared_pending[key] = threading.Event()
+
+        note_request("shared", "miss" if owner else "wait")
+        if not owner:
+            # если владелец упал с ошибкой, результата не будет — попробуем сами
+            event.wait()
+            continue
+
+        try:
+            value = compute()
+            with _shared_lock:
+                # данные успели обновиться, пока считали — такой результат не храним
+                if generation == (dataset, _data_generation[dataset]):
+                    _shared_results[key] = (dataset, span, value)
+                    while len(_shared_results) > SHARED_RESULTS_MAX:
+                        _shared_results.popitem(last=False)
+            return value
+        finally:
+            with _shared_lock:
+                _shared_pending.pop(key, None)
+            event.set()
+
+
+# =======================
+# ЗАГРУЗКА ТАБЛИЦ: ТАЙМАУТЫ И CIRCUIT BREAKER
+# =======================
+# Если Google недоступен, не ходим туда на каждый запрос:
+# после SHEETS_BREAKER_THRESHOLD ошибок подряд «размыкаемся» и отдаём старые данные,
+# пробуя снова через 30 с, 60 с, 120 с … (не дольше SHEETS_BACKOFF_MAX_SECONDS).
+SHEETS_FETCH_TIMEOUT = float(os.getenv("SHEETS_FETCH_TIMEOUT", "10"))
+# таймаут выше — на одно чтение из сокета; это — на всю загрузку таблицы целиком
+SHEETS_DOWNLOAD_DEADLINE = float(os.getenv("SHEETS_DOWNLOAD_DEADLINE", "30"))
+SHEETS_BREAKER_THRESHOLD = max(1, int(os.getenv("SHEETS_BREAKER_THRESHOLD", "3")))
+SHEETS_BACKOFF_BASE_SECONDS = float(os.getenv("SHEETS_BACKOFF_BASE_SECONDS", "30"))
+SHEETS_BACKOFF_MAX_SECONDS = float(os.getenv("SHEETS_BACKOFF_MAX_SECONDS", "900"))
+# сколько раз повторяем загрузку сразу, если старых данных нет совсем (например, после рестарта)
+SHEETS_COLD_RETRIES = max(0, int(os.getenv("SHEETS_COLD_RETRIES", "2")))
+
+
+class CircuitBreaker:
+    """
+    closed    — ходим в таблицу как обычно;
+    open      — не ходим до open_until, отдаём старые данные;
+    half_open — пропускаем ровно один пробный запрос, остальные получают старые данные.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0          # ошибок подряд
+        self.trips = 0             # сколько раз подряд размыкались — от этого зависит пауза
+        self.open_until = 0.0      # time.monotonic()
+        self.probe_in_flight = False
+        self.last_error = None
+        self.last_failure_at = None
+        self.last_success_at = None
+
+    def allow_request(self) -> bool:
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.probe_in_flight or time.monotonic() < self.open_until:
+                return False
+            self.state = "half_open"
+            self.probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.trips = 0
+            self.probe_in_flight = False
+            self.last_success_at = datetime.now(TZ)
+
+    def record_failure(self, error):
+        with self.lock:
+            self.failures += 1
+            self.probe_in_flight = False
+            self.last_error = f"{type(error).__name__}: {error}"
+            self.last_failure_at = datetime.now(TZ)
+
+            if self.state == "half_open" or self.failures >= SHEETS_BREAKER_THRESHOLD:
+                self.trips += 1
+                delay = min(SHEETS_BACKOFF_MAX_SECONDS, SHEETS_BACKOFF_BASE_SECONDS * 2 ** (self.trips - 1))
+                # немного разброса, чтобы обе таблицы не пробовали одновременно
+                self.open_until = time.monotonic() + delay * random.uniform(0.8, 1.2)
+                self.state = "open"
+
+    def describe(self) -> str:
+        with self.lock:
+            lines = [f"{self.name}: {self.state}"]
+            if self.state != "closed":
+                left = max(0, int(self.open_until - time.monotonic()))
+                lines.append(f"  следующая попытка через {left} с")
+            lines.append(f"  ошибок подряд: {self.failures}")
+            if self.last_success_at:
+                lines.append(f"  последняя удачная загрузка: {self.last_success_at.strftime('%d.%m.%Y %H:%M:%S')}")
+            if self.last_error:
+                lines.append(f"  последняя ошибка ({self.last_failure_at.strftime('%d.%m.%Y %H:%M:%S')}): {self.last_error}")
+            return "\n".join(lines)
+
+
+_sheets_breaker = CircuitBreaker("Выставки")
+_free_sheets_breaker = CircuitBreaker("Бесплатные дни")
+
+
+class _DeadlineStream(io.RawIOBase):
+    """
+    Поток ответа, который бросает Timeout после deadline (time.monotonic()).
+    Читаем через read1 — не больше одного чтения из сокета за раз, поэтому медленно
+    «капающий» ответ не застрянет внутри одной длинной строки CSV.
+    """
+
+    def __init__(self, raw, deadline):
+        self._raw = raw
+        self._deadline = deadline
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if time.monotonic() > self._deadline:
+            raise requests.Timeout(f"download took longer than {SHEETS_DOWNLOAD_DEADLINE:g}s")
+        data = self._raw.read1(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+def iter_csv_rows(url):
+    """
+    Читаем CSV прямо из ответа по мере скачивания — файл целиком в памяти не держим.
+    Отдаёт (номер строки в файле, список значений); первой идёт строка заголовков.
+    Таймаут — на каждое чтение из сокета, и SHEETS_DOWNLOAD_DEADLINE — на всю загрузку:
+    пока она идёт, держится блокировка кэша.
+    """
+    deadline = time.monotonic() + SHEETS_DOWNLOAD_DEADLINE
+    with requests.get(url, timeout=SHEETS_FETCH_TIMEOUT, stream=True) as resp:
+        resp.raise_for_status()
+        resp.raw.decode_content = True
+        resp.raw.auto_close = False  # иначе TextIOWrapper упадёт на закрытом потоке в конце файла
+        stream = io.BufferedReader(_DeadlineStream(resp.raw, deadline))
+        reader = csv.reader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+        for values in reader:
+            yield reader.line_num, values
+
+
+# =======================
+# ПРОВЕРКА СТРОК ПРИ ЗАГРУЗКЕ
+# =======================
+# Строки, которые не прошли проверку, не пропадают молча:
+# по каждой загрузке собираем отчёт (команда /rejected).
+BEST_YES = {"да", "yes", "true", "1", "y", "+"}
+BEST_NO = {"", "нет", "no", "false", "0", "n", "-"}
+
+_last_ingest = {}   # dataset -> отчёт последней загрузки
+
+
+def _new_ingest_report():
+    return {
+        "at": datetime.now(TZ),
+        "rows": 0,
+        "accepted": 0,
+        "rejected": Counter(),   # причина -> сколько строк
+        "warnings": Counter(),   # строка принята, но что-то поправили
+        "examples": [],          # (номер строки, причина, начало строки)
+    }
+
+
+def _reject(report, line_no, reason, values):
+    report["rejected"][reason] += 1
+    if len(report["examples"]) < 20:
+        report["examples"].append((line_no, reason, ", ".join(values)[:100]))
+
+
+def parse_sheet_date(value):
+    value = (value or "").strip()
+    if not value:
+        return None
+    for fmt in ("%Y-%m-%d", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    # остальные форматы — как раньше разбирал pandas
+    ts = pd.to_datetime(value, errors="coerce")
+    return None if pd.isna(ts) else ts.date()
+
+
+_URL_RE = re.compile(r"^https?://[^\s/\"<>]+\.[^\s\"<>]+$", re.IGNORECASE)
+
+
+def normalize_url(value):
+    """-> (url, ok). Пустая ссылка — не ошибка; кривая превращается в пустую."""
+    url = (value or "").strip()
+    if not url:
+        return "", True
+    if url.lower().startswith("www."):
+        url = "https://" + url
+    if _URL_RE.match(url):
+        return url, True
+    return "", False
+
+
+def _header_names(header, canonical):
+    """
+    Имена колонок для хранилища: известные колонки — под каноническими именами,
+    остальные — как в таблице (пустые и повторяющиеся получают суффикс).
+    """
+    names = []
+    for i, raw in enumerate(header):
+        name = canonical.get(raw.strip().lower(), raw.strip()) or f"Unnamed: {i}"
+        base, n = name, 1
+        while name in names:
+            name = f"{base}.{n}"
+            n += 1
+        names.append(name)
+    return names
+
+
+def _ingest(rows, names, validate, report):
+    """
+    Складываем проверенные строки сразу по колонкам — в памяти только итоговые данные.
+    validate(record) -> (row, reason, warnings); reason != None — строка отклонена.
+    """
+    store = {name: [] for name in names}
+
+    for line_no, values in rows:
+        if not any(v.strip() for v in values):
+            continue  # пустые строки в конце листа — не ошибка
+        report["rows"] += 1
+
+        record = dict(zip(names, values))
+        row, reason, warnings = validate(record)
+        if reason:
+            _reject(report, line_no, reason, values)
+            continue
+        for w in warnings:
+            report["warnings"][w] += 1
+
+        for name in names:
+            store[name].append(row.get(name))
+        report["accepted"] += 1
+
+    return pd.DataFrame(store, columns=names)
+
+
+def _clean(record):
+    return {k: (v.strip() or None) for k, v in record.items()}
+
+
+def _validate_exhibition(record):
+    row = _clean(record)
+    warnings = []
+
+    row["museum"] = row.get("museum") or ""
+    row["title"] = row.get("title") or ""
+    if not row["museum"]:
+        return None, "нет музея", warnings
+    if not row["title"]:
+        return None, "нет названия", warnings
+
+    row["start_date"] = parse_sheet_date(record.get("start_date"))
+    row["end_date"] = parse_sheet_date(record.get("end_date"))
+    if row["start_date"] is None:
+        return None, "не разобрала start_date", warnings
+    if row["end_date"] is None:
+        return None, "не разобрала end_date", warnings
+    if row["end_date"] < row["start_date"]:
+        return None, "end_date раньше start_date", warnings
+
+    row["url"], ok = normalize_url(record.get("url"))
+    if not ok:
+        warnings.append("плохая ссылка")
+
+    if "best" in record:
+        flag = record["best"].strip().lower()
+        row["best"] = flag in BEST_YES
+        if flag not in BEST_YES and flag not in BEST_NO:
+            warnings.append("непонятное значение BEST")
+
+    return row, None, warnings
+
+
+def _validate_free_day(record):
+    row = _clean(record)
+    warnings = []
+
+    row["date"] = parse_sheet_date(record.get("date"))
+    if row["date"] is None:
+        return None, "не разобрала дату", warnings
+
+    row["museum"] = row.get("museum") or ""
+    row["event"] = row.get("event") or ""
+    if not row["museum"]:
+        return None, "нет музея", warnings
+    if not row["event"]:
+        return None, "нет мероприятия", warnings
+
+    row["url"], ok = normalize_url(record.get("url"))
+    if not ok:
+        warnings.append("плохая ссылка")
+
+    return row, None, warnings
+
+
+def _download_with_breaker(breaker, download, have_stale):
+    """
+    Одна попытка обновить таблицу через breaker.
+    Возвращает DataFrame или None, если ходить в таблицу сейчас нельзя.
+    Без старых данных пробуем несколько раз подряд — иначе пользователю нечего показать.
+    """
+    if not breaker.allow_request():
+        return None
+
+    attempts = 1 if have_stale else 1 + SHEETS_COLD_RETRIES
+    for attempt in range(attempts):
+        try:
+            df = download()
+        except Exception as e:
+            if attempt + 1 < attempts:
+                time.sleep(0.5 * 2 ** attempt)
+                continue
+            breaker.record_failure(e)
+            raise
+        breaker.record_success()
+        return df
+
+
+EXHIBITION_COLUMNS = {
+    "museum": "museum",
+    "title": "title",
+    "url": "url",
+    "start_date": "start_date",
+    "end_date": "end_date",
+    "best": "best",
+}
+
 
 def _download_and_prepare_df():
     if not CSV_URL:
         raise RuntimeError("SHEETS_CSV_URL is not set")
 
-    df = pd.read_csv(CSV_URL)
-    df["start_date"] = pd.to_datetime(df["start_date"], errors="coerce").dt.date
-    df["end_date"] = pd.to_datetime(df["end_date"], errors="coerce").dt.date
-    df = df.dropna(subset=["start_date", "end_date"])
+    rows = iter_csv_rows(CSV_URL)
+    header = next(rows, None)
+    if header is None:
+        raise RuntimeError("Sheet is empty")
+
+    names = _header_names(header[1], EXHIBITION_COLUMNS)
+    missing = [c for c in ("museum", "title", "start_date", "end_date") if c not in names]
+    if missing:
+        raise RuntimeError(f"Sheet: не нашла колонки: {', '.join(missing)}")
+    if "url" not in names:
+        names.append("url")
+
+    report = _new_ingest_report()
+    df = _ingest(rows, names, _validate_exhibition, report)
+    _last_ingest["exhibitions"] = report
     return df
 
+def _log_sheet_refresh(dataset, df, diff, started):
+    # по request_id/ts обновления видно, какой запрос ждал загрузку таблицы
+    report = _last_ingest.get(dataset) or {}
+    log_event(
+        "sheet_refresh",
+        dataset=dataset,
+        duration_ms=round((time.perf_counter() - started) * 1000, 1),
+        rows=len(df),
+        initial=diff["initial"],
+        added=len(diff["added"]),
+        removed=len(diff["removed"]),
+        changed=len(diff["changed"]),
+        rejected=dict(report.get("rejected") or {}),
+    )
+
+
+def _log_sheet_error(dataset, breaker, error, started, have_stale):
+    log_event(
+        "sheet_error",
+        dataset=dataset,
+        duration_ms=round((time.perf_counter() - started) * 1000, 1),
+        error=f"{type(error).__name__}: {error}",
+        breaker=breaker.state,
+        served_stale=have_stale,
+    )
+
+
 def load_data_cached(force: bool = False):
     """
     force=True — принудительно обновить кэш.
@@ -200,19 +1168,48 @@ def load_data_cached(force: bool = False):
     if not force and _cache_df is not None and _cache_loaded_at is not None:
         age = (now - _cache_loaded_at).total_seconds()
         if age < CACHE_TTL_SECONDS:
+            note_request("data", "fresh")
             return _cache_df
 
+    # обновляет кто-то другой — не ждём его, если есть что показать
+    if not _cache_lock.acquire(blocking=_cache_df is None):
+        note_request("data", "stale")
+        return _cache_df
+
+    started = time.perf_counter()
     try:
-        df = _download_and_prepare_df()
+        if _cache_df is not None and _cache_loaded_at is not None and _cache_loaded_at > now:
+            note_request("data", "fresh")
+            return _cache_df  # пока ждали блокировку, данные уже обновили
+
+        df = _download_with_breaker(_sheets_breaker, _download_and_prepare_df, _cache_df is not None)
+        if df is None:
+            # breaker разомкнут — сразу отдаём старые данные
+            note_request("data", "breaker_open")
+            if _cache_df is not None:
+                return _cache_df
+            raise RuntimeError(f"Sheets unavailable, retry later ({_sheets_breaker.last_error})")
+
+        diff = diff_snapshots(_cache_df, df, EXHIBITION_KEY, ("start_date", "end_date"))
+        apply_diff("exhibitions", diff)
+        stamp_generation("exhibitions", df)
         _cache_df = df
-        _cache_loaded_at = now
+        _cache_loaded_at = datetime.now(TZ)
+        if diff["initial"] or diff["added"] or diff["removed"] or diff["changed"]:
+            rebuild_museum_index(df)
+            _materialize_wakeup.set()
+        note_request("data", "refreshed")
+        _log_sheet_refresh("exhibitions", df, diff, started)
         return df
     except Exception as e:
         # если сеть/таблица временно недоступны — используем старые данные
-        print("DATA load error:", e)
+        _log_sheet_error("exhibitions", _sheets_breaker, e, started, _cache_df is not None)
         if _cache_df is not None:
+            note_request("data", "stale")
             return _cache_df
         raise
+    finally:
+        _cache_lock.release()
 
 
 # =======================
@@ -232,7 +1229,6 @@ def build_free_days_url():
 
     # заменяем gid в URL
     if "gid=" in base_url:
-        import re
         return re.sub(r"gid=\d+", f"gid={FREE_GID}", base_url)
     else:
         # если вдруг его нет
@@ -240,52 +1236,34 @@ def build_free_days_url():
 
 _free_cache_df = None
 _free_cache_loaded_at = None
+_free_cache_lock = threading.Lock()
 
 
-def _normalize_free_days_columns(df: pd.DataFrame) -> pd.DataFrame:
-    """
-    Поддерживаем разные названия колонок.
-    Ожидаем смысл: date, museum, event, url
-    """
-    cols = {c: c.strip().lower() for c in df.columns}
-
-    def pick(*variants):
-        for v in variants:
-            for orig, low in cols.items():
-                if low == v:
-                    return orig
-        return None
-
-    c_date = pick("date", "дата")
-    c_museum = pick("museum", "музей", "название музея")
-    c_event = pick("event", "мероприятие", "название мероприятия", "title", "название")
-    c_url = pick("url", "ссылка", "link")
-
-    missing = [name for name, val in [("date/дата", c_date), ("museum/музей", c_museum), ("event/мероприятие", c_event), ("url/ссылка", c_url)] if val is None]
-    if missing:
-        raise RuntimeError(f"FREE days sheet: не нашла колонки: {', '.join(missing)}")
-
-    df = df.rename(columns={
-        c_date: "date",
-        c_museum: "museum",
-        c_event: "event",
-        c_url: "url",
-    })
-    return df
+# Поддерживаем разные названия колонок. Смысл: date, museum, event, url
+FREE_DAYS_COLUMNS = {
+    "date": "date", "дата": "date",
+    "museum": "museum", "музей": "museum", "название музея": "museum",
+    "event": "event", "мероприятие": "event", "название мероприятия": "event", "title": "event", "название": "event",
+    "url": "url", "ссылка": "url", "link": "url",
+}
 
 
 def _download_and_prepare_free_df():
     url = build_free_days_url()
-    df = pd.read_csv(url)
-    df = _normalize_free_days_columns(df)
 
-    df["date"] = pd.to_datetime(df["date"], errors="coerce").dt.date
-    df = df.dropna(subset=["date", "museum", "event"])
+    rows = iter_csv_rows(url)
+    header = next(rows, None)
+    if header is None:
+        raise RuntimeError("FREE days sheet is empty")
 
-    df["museum"] = df["museum"].astype(str).str.strip()
-    df["event"] = df["event"].astype(str).str.strip()
-    df["url"] = df["url"].astype(str).str.strip()
+    names = _header_names(header[1], FREE_DAYS_COLUMNS)
+    missing = [label for name, label in [("date", "date/дата"), ("museum", "museum/музей"), ("event", "event/мероприятие"), ("url", "url/ссылка")] if name not in names]
+    if missing:
+        raise RuntimeError(f"FREE days sheet: не нашла колонки: {', '.join(missing)}")
 
+    report = _new_ingest_report()
+    df = _ingest(rows, names, _validate_free_day, report)
+    _last_ingest["free_days"] = report
     return df
 
 
@@ -301,50 +1279,370 @@ def load_free_days_cached(force: bool = False):
     if not force and _free_cache_df is not None and _free_cache_loaded_at is not None:
         age = (now - _free_cache_loaded_at).total_seconds()
         if age < CACHE_TTL_SECONDS:
+            note_request("free_days", "fresh")
             return _free_cache_df
 
+    if not _free_cache_lock.acquire(blocking=_free_cache_df is None):
+        note_request("free_days", "stale")
+        return _free_cache_df
+
+    started = time.perf_counter()
     try:
-        df = _download_and_prepare_free_df()
+        if _free_cache_df is not None and _free_cache_loaded_at is not None and _free_cache_loaded_at > now:
+            note_request("free_days", "fresh")
+            return _free_cache_df
+
+        df = _download_with_breaker(_free_sheets_breaker, _download_and_prepare_free_df, _free_cache_df is not None)
+        if df is None:
+            note_request("free_days", "breaker_open")
+            if _free_cache_df is not None:
+                return _free_cache_df
+            raise RuntimeError(f"FREE days sheet unavailable, retry later ({_free_sheets_breaker.last_error})")
+
+        diff = diff_snapshots(_free_cache_df, df, FREE_DAYS_KEY, ("date", "date"))
+        apply_diff("free_days", diff)
+        stamp_generation("free_days", df)
         _free_cache_df = df
-        _free_cache_loaded_at = now
+        _free_cache_loaded_at = datetime.now(TZ)
+        if diff["initial"] or diff["added"] or diff["removed"] or diff["changed"]:
+            _materialize_wakeup.set()
+        note_request("free_days", "refreshed")
+        _log_sheet_refresh("free_days", df, diff, started)
         return df
     except Exception as e:
-        print("FREE DAYS load error:", e)
+        _log_sheet_error("free_days", _free_sheets_breaker, e, started, _free_cache_df is not None)
         if _free_cache_df is not None:
+            note_request("free_days", "stale")
             return _free_cache_df
         raise
+    finally:
+        _free_cache_lock.release()
+
+
+# =======================
+# ИЗМЕНЕНИЯ ДАННЫХ
+# =======================
+# Строка таблицы узнаётся по этим колонкам (без учёта регистра и пробелов).
+# Одинаковые ключи различаем по порядковому номеру.
+EXHIBITION_KEY = ("museum", "title")
+FREE_DAYS_KEY = ("date", "museum", "event")
+
+_last_diffs = {}   # dataset -> результат diff_snapshots() последнего обновления
+
+
+def _snapshot_rows(df, key_cols):
+    rows = {}
+    if df is None:
+        return rows
+
+    seen = Counter()
+    columns = list(df.columns)
+    for values in df.itertuples(index=False, name=None):
+        row = dict(zip(columns, values))
+        ident = tuple(str(row.get(c, "")).strip().lower() for c in key_cols)
+        seen[ident] += 1
+        rows[ident + (seen[ident],)] = row
+    return rows
+
 
+def _row_fingerprint(row):
+    return {k: ("" if pd.isna(v) else str(v)) for k, v in row.items()}
 
-def send_museum_chunks(chat_id, header_base, museum_blocks, max_len=3500):
+
+def diff_snapshots(old_df, new_df, key_cols, span_cols):
     """
-    header_base: строка без "Часть i/N" (мы добавим её сами)
-    museum_blocks: список строк, каждая = один музей (заголовок + его выставки)
+    Построчное сравнение старой и новой версии таблицы.
+    span_cols — колонки (начало, конец), по которым считаем затронутые даты.
+    """
+    old_rows = _snapshot_rows(old_df, key_cols)
+    new_rows = _snapshot_rows(new_df, key_cols)
+
+    added = [new_rows[k] for k in new_rows.keys() - old_rows.keys()]
+    removed = [old_rows[k] for k in old_rows.keys() - new_rows.keys()]
+    changed = [
+        (old_rows[k], new_rows[k])
+        for k in old_rows.keys() & new_rows.keys()
+        if _row_fingerprint(old_rows[k]) != _row_fingerprint(new_rows[k])
+    ]
+
+    touched = added + removed + [row for pair in changed for row in pair]
+    spans = []
+    for row in touched:
+        lo, hi = row.get(span_cols[0]), row.get(span_cols[1])
+        if pd.notna(lo) and pd.notna(hi):
+            spans.append((lo, hi))
+
+    return {
+        "at": datetime.now(TZ),
+        "initial": old_df is None,
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+        "spans": spans,
+        "museums": sorted({str(row.get("museum", "")).strip() for row in touched}),
+    }
+
+
+def apply_diff(dataset, diff):
+    """
+    Сбрасывает только те общие результаты, которых коснулись изменения.
+    """
+    _last_diffs[dataset] = diff
+
+    if diff["initial"]:
+        invalidate_shared(dataset)
+        return
+    if not (diff["added"] or diff["removed"] or diff["changed"]):
+        return
+
+    # строка без дат могла повлиять на что угодно
+    if len(diff["spans"]) < len(diff["added"]) + len(diff["removed"]) + 2 * len(diff["changed"]):
+        invalidate_shared(dataset)
+    else:
+        invalidate_shared(dataset, diff["spans"])
+
+
+# =======================
+# МУЗЕИ РЯДОМ
+# =======================
+# Координаты музеев берём из необязательных колонок таблицы (lat/lon или широта/долгота).
+# При каждом обновлении данных строим k-d дерево — поиск ближайших не перебирает все музеи.
+NEARBY_MUSEUMS = max(1, int(os.getenv("NEARBY_MUSEUMS", "5")))
+EARTH_RADIUS_KM = 6371.0
+
+_museum_index = None
+
+
+def _find_column(df, *variants):
+    for col in df.columns:
+        if str(col).strip().lower() in variants:
+            return col
+    return None
+
+
+def _to_xyz(lat, lon):
+    # точка на единичной сфере: евклидово расстояние растёт вместе с расстоянием по поверхности
+    lat, lon = math.radians(lat), math.radians(lon)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+class MuseumIndex:
+    """
+    k-d дерево по координатам музеев.
+    Узел: (точка, музей, ось, левое поддерево, правое поддерево).
+    """
+
+    def __init__(self, museums):
+        # museums: {название музея: (lat, lon)}
+        points = [(_to_xyz(lat, lon), name) for name, (lat, lon) in museums.items()]
+        self.size = len(points)
+        self.root = self._build(points, 0)
+
+    def _build(self, points, depth):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda p: p[0][axis])
+        mid = len(points) // 2
+        point, name = points[mid]
+        return (
+            point, name, axis,
+            self._build(points[:mid], depth + 1),
+            self._build(points[mid + 1:], depth + 1),
+        )
+
+    def nearest(self, lat, lon, k):
+        """k ближайших музеев: [(км, музей), ...] по возрастанию расстояния."""
+        target = _to_xyz(lat, lon)
+        heap = []  # (-квадрат расстояния, музей): на вершине — самый дальний из найденных
+
+        def visit(node):
+            if node is None:
+                return
+            point, name, axis, left, right = node
+
+            d2 = sum((a - b) ** 2 for a, b in zip(point, target))
+            if len(heap) < k:
+                heapq.heappush(heap, (-d2, name))
+            elif d2 < -heap[0][0]:
+                heapq.heapreplace(heap, (-d2, name))
+
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            # в другую половину идём, только если там может быть кто-то ближе
+            if len(heap) < k or diff * diff < -heap[0][0]:
+                visit(far)
+
+        visit(self.root)
+
+        result = []
+        for neg_d2, name in heap:
+            chord = math.sqrt(-neg_d2)
+            km = 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+            result.append((km, name))
+        result.sort()
+        return result
+
+
+def rebuild_museum_index(df):
+    global _museum_index
+
+    c_lat = _find_column(df, "lat", "latitude", "широта")
+    c_lon = _find_column(df, "lon", "lng", "longitude", "долгота")
+    if c_lat is None or c_lon is None:
+        _museum_index = None
+        return
+
+    coords = df[["museum", c_lat, c_lon]].copy()
+    coords["museum"] = coords["museum"].astype(str).str.strip()
+    # в таблице бывает запятая вместо точки: 48,2049
+    for col in (c_lat, c_lon):
+        coords[col] = pd.to_numeric(coords[col].astype(str).str.replace(",", ".").str.strip(), errors="coerce")
+    coords = coords.dropna()
+    coords = coords[coords[c_lat].between(-90, 90) & coords[c_lon].between(-180, 180)]
+
+    # у музея одни координаты — берём из первой строки, где они есть
+    museums = {
+        row[0]: (row[1], row[2])
+        for row in coords.drop_duplicates(subset=["museum"]).itertuples(index=False, name=None)
+    }
+    _museum_index = MuseumIndex(museums) if museums else None
+
+
+def museum_blocks_on_date(df, user_date):
+    """
+    Выставки, открытые в user_date, по музеям: {музей: блок}.
+    Общий результат для всех, как exhibitions_on_date().
+    """
+    def compute():
+        matches = df[(df["start_date"] <= user_date) & (df["end_date"] >= user_date)]
+        names = matches["museum"].astype(str).str.strip()
+        return {
+            museum: build_museum_blocks(rows)[0]
+            for museum, rows in matches.groupby(names)
+        }
+
+    return shared_result(("museums_on_date", user_date), df, compute, span=(user_date, user_date))
+
+
+# =======================
+# РАЗБИЕНИЕ НА СООБЩЕНИЯ
+# =======================
+# Telegram ограничивает сообщение 4096 символами, причём считает их в UTF-16
+# (эмодзи = 2) и уже после разбора HTML: теги не считаются, &amp; — один символ.
+TELEGRAM_MAX_MESSAGE_LEN = 4096
+
+_HTML_TAG_RE = re.compile(r"<[^>]*>")
+
+
+def telegram_len(text: str) -> int:
+    """Длина текста с parse_mode=HTML так, как её посчитает Telegram."""
+    visible = html.unescape(_HTML_TAG_RE.sub("", text))
+    return len(visible.encode("utf-16-le")) // 2
+
+
+def _split_long_line(line, room):
+    """
+    Строка, которая сама по себе не влезает в сообщение: режем видимый текст
+    по room символов UTF-16. Разметка при этом теряется — иначе пришлось бы резать тег.
+    """
+    if telegram_len(line) <= room:
+        return [line]
+
+    pieces = []
+    piece = ""
+    used = 0
+    for ch in html.unescape(_HTML_TAG_RE.sub("", line)):
+        width = 2 if ord(ch) > 0xFFFF else 1
+        if used + width > room:
+            pieces.append(html.escape(piece))
+            piece, used = "", 0
+        piece += ch
+        used += width
+    if piece:
+        pieces.append(html.escape(piece))
+    return pieces
+
+
+def _pack_blocks(blocks, room):
+    """
+    Жадно складываем блоки в сообщения по room символов (в понятиях telegram_len).
+    Блок целиком переносится в следующее сообщение, если не влезает в текущее.
+    Блок больше целого сообщения режем по строкам: он начинается в текущем сообщении,
+    а в каждом следующем повторяем его заголовок (первую строку) с пометкой «продолжение».
     """
-    # 1) сначала соберём чанки (без отправки), чтобы узнать N
     chunks = []
-    chunk = ""
+    parts = []
+    used = 0
+
+    def flush():
+        nonlocal parts, used
+        if parts:
+            chunks.append("".join(parts))
+        parts, used = [], 0
+
+    def add(text, sep):
+        nonlocal used
+        if parts:
+            parts.append(sep)
+            used += len(sep)
+        parts.append(text)
+        used += telegram_len(text)
+
+    def fits(text, sep):
+        return used + (len(sep) if parts else 0) + telegram_len(text) <= room
+
+    for block in blocks:
+        block = block.strip()
+        if not block:
+            continue
 
-    for block in museum_blocks:
-        piece = block.strip() + "\n\n"
-        if not piece.strip():
+        if fits(block, "\n\n"):
+            add(block, "\n\n")
             continue
 
-        # если один музейный блок слишком большой — отправим его отдельно
-        if len(piece) > max_len:
-            if chunk.strip():
-                chunks.append(chunk.strip())
-                chunk = ""
-            chunks.append(piece.strip())
+        if telegram_len(block) <= room:
+            flush()
+            add(block, "\n\n")
             continue
 
-        if len(chunk) + len(piece) > max_len:
-            chunks.append(chunk.strip())
-            chunk = ""
+        # блок больше целого сообщения
+        head, *lines = block.split("\n")
+        cont_head = f"{head} (продолжение)"
+        line_room = room - telegram_len(cont_head) - 1
 
-        chunk += piece
+        # в текущем сообщении должны уместиться хотя бы заголовок и первая строка
+        first_piece = _split_long_line(lines[0], line_room)[:1] if lines else []
+        if not fits("\n".join([head] + first_piece), "\n\n"):
+            flush()
+        add(head, "\n\n")
 
-    if chunk.strip():
-        chunks.append(chunk.strip())
+        for line in lines:
+            for piece in _split_long_line(line, line_room):
+                if not fits(piece, "\n"):
+                    flush()
+                    add(cont_head, "")
+                add(piece, "\n")
+
+    flush()
+    return chunks
+
+
+def send_museum_chunks(chat_id, header_base, museum_blocks, max_len=TELEGRAM_MAX_MESSAGE_LEN):
+    """
+    header_base: строка без "Часть i/N" (мы добавим её сами)
+    museum_blocks: список строк, каждая = один музей (заголовок + его выставки)
+    """
+    # 1) сначала соберём чанки (без отправки), чтобы узнать N.
+    # Длина заголовка зависит от числа цифр в N, поэтому пересобираем, пока N не устоится.
+    total = 1
+    while True:
+        header_len = telegram_len(f"{header_base}\nЧасть {total}/{total}\n\n")
+        chunks = _pack_blocks(museum_blocks, max_len - header_len)
+        if len(str(max(1, len(chunks)))) <= len(str(total)):
+            break
+        total = len(chunks)
 
     total = max(1, len(chunks))
 
@@ -365,9 +1663,6 @@ def stats_cmd(message):
         bot.reply_to(message, "Эта команда доступна только администратору.")
         return
 
-    # 👉 Сохраняем статистику перед выводом
-    _save_stats(force=True)
-
     unique_count = len(set(_stats.get("unique_users", [])))
     total = _stats.get("total_requests", 0)
 
@@ -400,6 +1695,117 @@ def stats_cmd(message):
     bot.reply_to(message, text)
 
 
+def _describe_row(row, fields):
+    return " — ".join(str(row.get(f, "")).strip() for f in fields)
+
+
+def _describe_diff(title, diff, fields, limit=10, museums_limit=30):
+    if diff is None:
+        return f"{title}: ещё не загружались"
+
+    when = diff["at"].strftime("%d.%m.%Y %H:%M")
+    if diff["initial"]:
+        return f"{title} ({when}): первая загрузка, строк: {len(diff['added'])}"
+
+    lines = [f"{title} ({when}): +{len(diff['added'])} / −{len(diff['removed'])} / ~{len(diff['changed'])}"]
+    for row in diff["added"][:limit]:
+        lines.append(f"  + {_describe_row(row, fields)}")
+    for row in diff["removed"][:limit]:
+        lines.append(f"  − {_describe_row(row, fields)}")
+    for old, new in diff["changed"][:limit]:
+        old_fp, new_fp = _row_fingerprint(old), _row_fingerprint(new)
+        fields_changed = ", ".join(
+            f"{k}: {old_fp.get(k, '')} → {new_fp.get(k, '')}"
+            for k in sorted(old_fp.keys() | new_fp.keys())
+            if old_fp.get(k) != new_fp.get(k)
+        )
+        lines.append(f"  ~ {_describe_row(new, fields)} ({fields_changed})")
+
+    hidden = sum(max(0, len(diff[k]) - limit) for k in ("added", "removed", "changed"))
+    if hidden:
+        lines.append(f"  … и ещё {hidden}")
+    if diff["museums"]:
+        museums = ", ".join(diff["museums"][:museums_limit])
+        if len(diff["museums"]) > museums_limit:
+            museums += f" … и ещё {len(diff['museums']) - museums_limit}"
+        lines.append("  Музеи: " + museums)
+    return "\n".join(lines)
+
+
+@bot.message_handler(commands=["changes"])
+def changes_cmd(message):
+    if message.from_user.id not in ADMIN_IDS:
+        bot.reply_to(message, "Эта команда доступна только администратору.")
+        return
+
+    # при большой правке таблицы отчёт не влезает в одно сообщение — режем как списки выставок
+    blocks = [
+        _describe_diff("Выставки", _last_diffs.get("exhibitions"), ("museum", "title")),
+        _describe_diff("Бесплатные дни", _last_diffs.get("free_days"), ("date", "museum", "event")),
+    ]
+    send_museum_chunks(
+        message.chat.id,
+        "📝 Что изменилось при последнем обновлении",
+        [html.escape(block) for block in blocks],
+    )
+
+
+@bot.message_handler(commands=["health"])
+def health_cmd(message):
+    if message.from_user.id not in ADMIN_IDS:
+        bot.reply_to(message, "Эта команда доступна только администратору.")
+        return
+
+    now = datetime.now(TZ)
+
+    def age(loaded_at):
+        if loaded_at is None:
+            return "не загружались"
+        return f"{int((now - loaded_at).total_seconds())} с назад"
+
+    text = (
+        "🩺 Загрузка таблиц\n\n"
+        f"{_sheets_breaker.describe()}\n"
+        f"  данные в памяти: {age(_cache_loaded_at)}\n\n"
+        f"{_free_sheets_breaker.describe()}\n"
+        f"  данные в памяти: {age(_free_cache_loaded_at)}\n\n"
+        f"Предрасчёт на день: {age(_materialized_at)}"
+    )
+    bot.reply_to(message, text)
+
+
+def _describe_ingest(title, report):
+    if report is None:
+        return f"{title}: ещё не загружались"
+
+    lines = [
+        f"{title} ({report['at'].strftime('%d.%m.%Y %H:%M')}): "
+        f"строк {report['rows']}, принято {report['accepted']}, отклонено {sum(report['rejected'].values())}"
+    ]
+    for reason, count in report["rejected"].most_common():
+        lines.append(f"  ✗ {reason}: {count}")
+    for reason, count in report["warnings"].most_common():
+        lines.append(f"  ⚠ {reason}: {count}")
+    for line_no, reason, excerpt in report["examples"][:10]:
+        lines.append(f"  строка {line_no}: {reason} — {excerpt}")
+    return "\n".join(lines)
+
+
+@bot.message_handler(commands=["rejected"])
+def rejected_cmd(message):
+    if message.from_user.id not in ADMIN_IDS:
+        bot.reply_to(message, "Эта команда доступна только администратору.")
+        return
+
+    text = (
+        "🧾 Проверка строк при последней загрузке\n\n"
+        + _describe_ingest("Выставки", _last_ingest.get("exhibitions"))
+        + "\n\n"
+        + _describe_ingest("Бесплатные дни", _last_ingest.get("free_days"))
+    )
+    bot.reply_to(message, text)
+
+
 @bot.message_handler(commands=["start"])
 def start(message):
     text = (
@@ -409,8 +1815,10 @@ def start(message):
         "⏳ Какие выставки заканчиваются скоро\n"
         "🆕 Новые выставки\n"
         "⭐️ Лучшие выставки месяца (на мой сугубо личный взгляд)\n\n"
-        "Также можно выбрать дату в календаре или просто написать её.\n\n"
+        "Также можно выбрать дату в календаре или просто написать её — "
+        "или целый период: «12.03–20.03», «выходные», «следующая неделя».\n\n"
         "🆓 А ещё я покажу дни бесплатного посещения музеев на ближайший месяц.\n\n"
+        "📍 Пришли геолокацию — покажу, что открыто сегодня в ближайших музеях.\n\n"
         "Выбирай кнопку ниже 👇"
     )
 
@@ -430,6 +1838,14 @@ def send_matches(chat_id, matches, header_base, show_start: bool = False):
         bot.send_message(chat_id, "Ничего не найдено.")
         return
 
+    send_museum_chunks(chat_id, header_base, build_museum_blocks(matches, show_start))
+
+
+def build_museum_blocks(matches, show_start: bool = False):
+    """
+    matches (DataFrame) -> список блоков-строк, один блок = один музей.
+    Отдельно от отправки, чтобы готовые блоки можно было переиспользовать.
+    """
     matches = matches.sort_values(by=["museum", "end_date", "title"])
 
     museum_blocks = []
@@ -439,7 +1855,7 @@ def send_matches(chat_id, matches, header_base, show_start: bool = False):
     for _, row in matches.iterrows():
         museum = html.escape(str(row["museum"]).strip())
         title = html.escape(str(row["title"]).replace("\n", " ").strip())
-        url = str(row["url"]).strip()
+        url = str(row["url"] or "").strip()
 
         start_date = row["start_date"]
         end_date = row["end_date"]
@@ -455,21 +1871,93 @@ def send_matches(chat_id, matches, header_base, show_start: bool = False):
             current_museum = museum
             lines.append(f"🏛 {museum}\n")
 
-        # 👉 Формат вывода
+        # 👉 Формат вывода (ссылки уже проверены при загрузке; без ссылки — просто название)
+        link = f"<a href=\"{url}\">{title}</a>" if url else title
         if show_start:
-            lines.append(f"  • ✨ <a href=\"{url}\">{title}</a> (с {start_text} по {end_text})\n")
+            lines.append(f"  • ✨ {link} (с {start_text} по {end_text})\n")
         else:
-            lines.append(f"  • ✨ <a href=\"{url}\">{title}</a> (до {end_text})\n")
+            lines.append(f"  • ✨ {link} (до {end_text})\n")
 
     # Добавляем последний музей
     if lines:
         museum_blocks.append("".join(lines).strip())
 
-    send_museum_chunks(chat_id, header_base, museum_blocks)
+    return museum_blocks
+
+
+def exhibitions_on_date(df, user_date):
+    """
+    Выставки, открытые в user_date: (количество, блоки по музеям).
+    Считается один раз на дату — общий результат для всех пользователей.
+    """
+    def compute():
+        matches = df[(df["start_date"] <= user_date) & (df["end_date"] >= user_date)]
+        return len(matches), build_museum_blocks(matches)
+
+    return shared_result(("date", user_date), df, compute, span=(user_date, user_date))
+
+def exhibitions_in_range(df, start, end, by_day: bool = False):
+    """
+    Выставки, открытые хотя бы в один день периода: (количество, блоки).
+    Один проход по таблице — пересечение интервалов, а не фильтр на каждый день.
+    by_day=True — блоки по дням: на каждый день то, что в этот день открыто.
+    """
+    def compute():
+        matches = df[(df["start_date"] <= end) & (df["end_date"] >= start)]
+        if not by_day:
+            return len(matches), build_museum_blocks(matches, show_start=True)
+        return len(matches), build_day_blocks(matches, start, end)
+
+    return shared_result(("range", start, end, by_day), df, compute, span=(start, end))
+
+
+def build_day_blocks(matches, start, end):
+    """
+    Заметание по дням: выставки отсортированы по началу, открытые сейчас лежат в куче
+    по дате окончания. Каждая строка добавляется и удаляется ровно один раз.
+    """
+    rows = sorted(
+        matches.itertuples(index=False),
+        key=lambda r: r.start_date
+    )
+
+    blocks = []
+    active = []  # (end_date, порядковый номер, строка)
+    i = 0
+    day = start
+    while day <= end:
+        while i < len(rows) and rows[i].start_date <= day:
+            heapq.heappush(active, (rows[i].end_date, i, rows[i]))
+            i += 1
+        while active and active[0][0] < day:
+            heapq.heappop(active)
+
+        if active:
+            open_today = pd.DataFrame([r for _, _, r in active], columns=matches.columns)
+            weekday = WEEKDAYS_SHORT_RU[day.weekday()]
+            blocks.append(
+                f"📅 <b>{weekday}, {format_date_ddmmyyyy(day)}</b>\n"
+                + "\n".join(build_museum_blocks(open_today))
+            )
+        day += timedelta(days=1)
+
+    return blocks
+
+
+def ending_soon_result(df, today):
+    """Заканчиваются в ближайшие 2 недели: (количество, блоки по музеям)."""
+    until = today + timedelta(days=14)
+
+    def compute():
+        matches = df[(df["end_date"] >= today) & (df["end_date"] <= until)]
+        return len(matches), build_museum_blocks(matches)
+
+    return shared_result(("ending", today), df, compute, span=(today, until))
+
 
 @bot.message_handler(commands=["ending_soon"])
 def ending_soon_cmd(message):
-    today = datetime.today().date()
+    today = vienna_today()
     until = today + timedelta(days=14)
 
     record_request(
@@ -484,23 +1972,34 @@ def ending_soon_cmd(message):
         bot.reply_to(message, "Не удалось прочитать таблицу. Проверь доступ по ссылке.")
         return
 
-    matches = df[(df["end_date"] >= today) & (df["end_date"] <= until)]
+    count, blocks = ending_soon_result(df, today)
 
-    if matches.empty:
+    if not count:
         bot.send_message(message.chat.id, "В ближайшие 2 недели ничего не заканчивается.")
         return
 
     header_base = (
         f"⏳ Заканчиваются в ближайшие 2 недели\n"
         f"Период: {today.strftime('%d.%m.%Y')} – {until.strftime('%d.%m.%Y')}\n"
-        f"Найдено: {len(matches)}"
+        f"Найдено: {count}"
     )
-    send_matches(message.chat.id, matches, header_base)
+    send_museum_chunks(message.chat.id, header_base, blocks)
+
+
+def starting_soon_result(df, today):
+    """Начинаются в ближайшие 2 недели: (количество, блоки по музеям)."""
+    until = today + timedelta(days=14)
+
+    def compute():
+        matches = df[(df["start_date"] >= today) & (df["start_date"] <= until)]
+        return len(matches), build_museum_blocks(matches, show_start=True)
+
+    return shared_result(("starting", today), df, compute, span=(today, until))
 
 
 @bot.message_handler(commands=["starting_soon"])
 def starting_soon_cmd(message):
-    today = datetime.today().date()
+    today = vienna_today()
     until = today + timedelta(days=14)
 
     record_request(
@@ -515,23 +2014,76 @@ def starting_soon_cmd(message):
         bot.reply_to(message, "Не удалось прочитать таблицу. Проверь доступ по ссылке.")
         return
 
-    matches = df[(df["start_date"] >= today) & (df["start_date"] <= until)]
+    count, blocks = starting_soon_result(df, today)
 
-    if matches.empty:
+    if not count:
         bot.send_message(message.chat.id, "В ближайшие 2 недели ничего не начинается.")
         return
 
     header_base = (
         f"🆕 Начинаются в ближайшие 2 недели\n"
         f"Период: {today.strftime('%d.%m.%Y')} – {until.strftime('%d.%m.%Y')}\n"
-        f"Найдено: {len(matches)}"
+        f"Найдено: {count}"
     )
-    send_matches(message.chat.id, matches, header_base, show_start=True)
+    send_museum_chunks(message.chat.id, header_base, blocks)
+
+
+
+def build_free_day_blocks(window):
+    """
+    Бесплатные дни (DataFrame) -> блоки: один блок = одна дата, внутри группировка по музеям.
+    """
+    window = window.sort_values(by=["date", "museum", "event"])
+
+    blocks = []
+    current_date = None
+    current_museum = None
+    lines = []
+
+    for _, row in window.iterrows():
+        d = row["date"]
+        museum = html.escape(str(row["museum"]).strip())
+        event = html.escape(str(row["event"]).replace("\n", " ").strip())
+        url = str(row["url"]).strip()
+
+        # новая дата → закрываем предыдущий блок
+        if d != current_date:
+            if lines:
+                blocks.append("".join(lines).strip())
+                lines = []
+            current_date = d
+            current_museum = None
+            lines.append(f"📅 <b>{format_date_ddmmyyyy(d)}</b>\n")
+
+        # новый музей внутри даты
+        if museum != current_museum:
+            current_museum = museum
+            lines.append(f"🏛 {museum}\n")
+
+        if url and url.lower().startswith(("http://", "https://")):
+            lines.append(f"  • 🎟 <a href=\"{url}\">{event}</a>\n")
+        else:
+            lines.append(f"  • 🎟 {event}\n")
+
+    if lines:
+        blocks.append("".join(lines).strip())
+
+    return blocks
+
 
+def free_days_30_result(df, base):
+    """Бесплатные дни на 30 дней вперёд (включительно): (количество, блоки по датам)."""
+    until = base + timedelta(days=30)
+
+    def compute():
+        window = df[(df["date"] >= base) & (df["date"] <= until)]
+        return len(window), build_free_day_blocks(window)
+
+    return shared_result(("free_days_30", base), df, compute, dataset="free_days", span=(base, until))
 
 
 def free_days_30_cmd(message):
-    base = datetime.now(TZ).date()
+    base = vienna_today()
     until = base + timedelta(days=30)
 
     record_request(
@@ -552,15 +2104,14 @@ def free_days_30_cmd(message):
         bot.send_message(message.chat.id, "Не удалось загрузить таблицу бесплатных дней 😕", reply_markup=main_keyboard())
         return
 
-    # фильтр по окну 30 дней (включительно)
-    window = df[(df["date"] >= base) & (df["date"] <= until)].copy()
+    count, blocks = free_days_30_result(df, base)
 
     try:
         bot.delete_message(message.chat.id, status.message_id)
     except Exception:
         pass
 
-    if window.empty:
+    if not count:
         bot.send_message(
             message.chat.id,
             f"🆓 Бесплатный вход\n"
@@ -569,56 +2120,56 @@ def free_days_30_cmd(message):
         )
         return
 
-    window = window.sort_values(by=["date", "museum", "event"])
+    header_base = (
+        "🆓 Бесплатный вход на ближайшие 30 дней\n"
+        f"Период: {base.strftime('%d.%m.%Y')} – {until.strftime('%d.%m.%Y')}\n"
+        f"Найдено: {count}"
+    )
 
-    # Собираем блоки: один блок = одна дата, внутри группировка по музеям
-    blocks = []
-    current_date = None
-    current_museum = None
-    lines = []
+    # используем ваш механизм разбиения на части
+    send_museum_chunks(message.chat.id, header_base, blocks)
 
-    for _, row in window.iterrows():
-        d = row["date"]
-        museum = html.escape(str(row["museum"]).strip())
-        event = html.escape(str(row["event"]).replace("\n", " ").strip())
-        url = str(row["url"]).strip()
 
-        # новая дата → закрываем предыдущий блок
-        if d != current_date:
-            if lines:
-                blocks.append("".join(lines).strip())
-                lines = []
-            current_date = d
-            current_museum = None
-            lines.append(f"📅 <b>{format_date_ddmmyyyy(d)}</b>\n")
+def best_month_result(df, base):
+    """
+    Лучшие выставки на ближайшие 30 дней: (количество, блоки по музеям).
+    Колонка BEST при загрузке приводится к best: True/False — без неё вызывать нельзя.
+    """
+    month_end = base + timedelta(days=30)
 
-        # новый музей внутри даты
-        if museum != current_museum:
-            current_museum = museum
-            lines.append(f"🏛 {museum}\n")
+    def compute():
+        # Маска лучших
+        best_mask = df["best"].astype(bool)
 
-        if url and url.lower().startswith(("http://", "https://")):
-            lines.append(f"  • 🎟 <a href=\"{url}\">{event}</a>\n")
-        else:
-            lines.append(f"  • 🎟 {event}\n")
+        # Уже началась
+        already_started = df["start_date"] <= base
 
-    if lines:
-        blocks.append("".join(lines).strip())
+        # Ещё не закончилась
+        not_finished = df["end_date"] >= base
 
-    header_base = (
-        "🆓 Бесплатный вход на ближайшие 30 дней\n"
-        f"Период: {base.strftime('%d.%m.%Y')} – {until.strftime('%d.%m.%Y')}\n"
-        f"Найдено: {len(window)}"
-    )
+        # Заканчивается в пределах ближайших 30 дней
+        ends_within_month = df["end_date"] <= month_end
 
-    # используем ваш механизм разбиения на части
-    send_museum_chunks(message.chat.id, header_base, blocks)
+        # Покрывает весь месяц (началась раньше и закончится позже месяца)
+        covers_whole_month = (
+            (df["start_date"] <= base) &
+            (df["end_date"] >= month_end)
+        )
+
+        matches = df[
+            best_mask &
+            already_started &
+            not_finished &
+            (ends_within_month | covers_whole_month)
+        ]
+        return len(matches), build_museum_blocks(matches)
+
+    return shared_result(("best_month", base), df, compute, span=(base, month_end))
 
 
 @bot.message_handler(commands=["best_month"])
 def best_month_cmd(message):
-    base = datetime.today().date()
-    tomorrow = base + timedelta(days=1)
+    base = vienna_today()
     month_end = base + timedelta(days=30)
 
     record_request(
@@ -633,14 +2184,7 @@ def best_month_cmd(message):
         bot.reply_to(message, "Не удалось прочитать таблицу. Проверь доступ по ссылке.")
         return
 
-    # Проверка наличия колонки BEST (без падения регистра)
-    best_column = None
-    for col in df.columns:
-        if col.strip().lower() == "best":
-            best_column = col
-            break
-
-    if not best_column:
+    if "best" not in df.columns:
         bot.send_message(
             message.chat.id,
             "В таблице нет колонки 'BEST'. Добавь колонку BEST со значением 'да' для лучших выставок 🙂",
@@ -648,37 +2192,9 @@ def best_month_cmd(message):
         )
         return
 
-    # Маска лучших
-    best_mask = (
-        df[best_column].astype(str).str.strip().str.lower()
-        .isin({"да", "yes", "true", "1", "y"})
-    )
-
+    count, blocks = best_month_result(df, base)
 
-    # Уже началась
-    already_started = df["start_date"] <= base
-
-    # Ещё не закончилась
-    not_finished = df["end_date"] >= base
-
-    # Заканчивается в пределах ближайших 30 дней
-    ends_within_month = df["end_date"] <= month_end
-
-    # Покрывает весь месяц (началась раньше и закончится позже месяца)
-    covers_whole_month = (
-        (df["start_date"] <= base) &
-        (df["end_date"] >= month_end)
-    )
-
-    matches = df[
-        best_mask &
-        already_started &
-        not_finished &
-        (ends_within_month | covers_whole_month)
-    ]
-
-
-    if matches.empty:
+    if not count:
         bot.send_message(
             message.chat.id,
             "Лучших выставок по этому правилу не нашла 😅",
@@ -689,10 +2205,10 @@ def best_month_cmd(message):
     header_base = (
         f"⭐ Лучшие выставки месяца\n"
         f"Период: {base.strftime('%d.%m.%Y')} – {month_end.strftime('%d.%m.%Y')}\n"
-        f"Найдено: {len(matches)}"
+        f"Найдено: {count}"
     )
 
-    send_matches(message.chat.id, matches, header_base)
+    send_museum_chunks(message.chat.id, header_base, blocks)
 
 
 
@@ -722,6 +2238,123 @@ def about_command(message):
     )
 
 
+@bot.message_handler(content_types=["location"])
+def nearby_cmd(message):
+    lat = message.location.latitude
+    lon = message.location.longitude
+    today = vienna_today()
+
+    record_request(
+        message.from_user.id,
+        today.strftime("%Y-%m-%d"),
+        source="location"
+    )
+
+    status = bot.send_message(message.chat.id, "🔍 Ищу выставки рядом…")
+
+    try:
+        df = load_data_cached()
+    except Exception:
+        try:
+            bot.delete_message(message.chat.id, status.message_id)
+        except Exception:
+            pass
+        bot.reply_to(message, "Не удалось прочитать таблицу. Проверь доступ по ссылке.")
+        return
+
+    index = _museum_index
+    open_today = museum_blocks_on_date(df, today) if index is not None else {}
+
+    # ближайшие музеи, где сегодня что-то открыто; если среди первых k таких мало — расширяем поиск
+    found = []
+    k = NEARBY_MUSEUMS
+    while index is not None:
+        found = [(km, name) for km, name in index.nearest(lat, lon, k) if name in open_today]
+        if len(found) >= NEARBY_MUSEUMS or k >= index.size:
+            break
+        k *= 2
+    found = found[:NEARBY_MUSEUMS]
+
+    try:
+        bot.delete_message(message.chat.id, status.message_id)
+    except Exception:
+        pass
+
+    if index is None:
+        bot.send_message(
+            message.chat.id,
+            "Пока не знаю, где находятся музеи 🙈 Попробуй выбрать дату или кнопку ниже.",
+            reply_markup=main_keyboard()
+        )
+        return
+
+    if not found:
+        bot.send_message(
+            message.chat.id,
+            "Рядом сегодня ничего не нашла 😕",
+            reply_markup=main_keyboard()
+        )
+        return
+
+    blocks = []
+    for km, name in found:
+        head, _, rest = open_today[name].partition("\n")
+        blocks.append(f"{head} · {km:.1f} км\n{rest}")
+
+    header_base = f"📍 Открыто сегодня рядом с тобой\nМузеев: {len(found)}"
+    send_museum_chunks(message.chat.id, header_base, blocks)
+
+
+def range_cmd(message, start, end, by_day: bool = False):
+    days = (end - start).days + 1
+    if days > MAX_RANGE_DAYS:
+        bot.send_message(
+            message.chat.id,
+            f"Слишком длинный период 😅 Можно не больше {MAX_RANGE_DAYS} дней.",
+            reply_markup=main_keyboard()
+        )
+        return
+
+    record_request(
+        message.from_user.id,
+        f"{start.strftime('%Y-%m-%d')}..{end.strftime('%Y-%m-%d')}",
+        source="range"
+    )
+
+    status = bot.send_message(message.chat.id, "🔍 Ищу выставки…")
+
+    try:
+        df = load_data_cached()
+    except Exception:
+        try:
+            bot.delete_message(message.chat.id, status.message_id)
+        except Exception:
+            pass
+        bot.reply_to(message, "Не удалось прочитать таблицу. Проверь доступ по ссылке.")
+        return
+
+    count, blocks = exhibitions_in_range(df, start, end, by_day)
+
+    try:
+        bot.delete_message(message.chat.id, status.message_id)
+    except Exception:
+        pass
+
+    if not count:
+        bot.send_message(
+            message.chat.id,
+            "В этот период выставок не найдено.",
+            reply_markup=main_keyboard()
+        )
+        return
+
+    header_base = (
+        f"🗓 Выставки с {format_date_ddmmyyyy(start)} по {format_date_ddmmyyyy(end)}\n"
+        f"Найдено: {count}"
+    )
+    send_museum_chunks(message.chat.id, header_base, blocks)
+
+
 @bot.message_handler(func=lambda m: True)
 def handle(message):
     text = (message.text or "").strip()
@@ -732,7 +2365,7 @@ def handle(message):
     # === 1. Кнопки ===
 
     if action == "today":
-        user_date = datetime.today().date()
+        user_date = vienna_today()
 
     elif action == "ending":
         ending_soon_cmd(message)
@@ -750,6 +2383,11 @@ def handle(message):
         free_days_30_cmd(message)
         return
 
+    elif action == "weekend":
+        start, end, by_day = parse_date_range("выходные по дням")
+        range_cmd(message, start, end, by_day)
+        return
+
     elif action == "pick_date":
         calendar, step = DetailedTelegramCalendar().build()
         bot.send_message(
@@ -763,14 +2401,20 @@ def handle(message):
     # === 2. Ввод вручную ===
 
     elif key in ("сегодня", "today"):
-        user_date = datetime.today().date()
+        user_date = vienna_today()
 
     elif key in ("завтра", "tomorrow"):
-        user_date = (datetime.today() + timedelta(days=1)).date()
+        user_date = vienna_today() + timedelta(days=1)
 
     else:
         user_date = parse_date(text)
 
+        if not user_date:
+            date_range = parse_date_range(text)
+            if date_range:
+                range_cmd(message, *date_range)
+                return
+
     # === 3. Проверка даты ===
 
     if not user_date:
@@ -778,6 +2422,7 @@ def handle(message):
             message.chat.id,
             "Не понял дату 😅\n"
             "Примеры: 2026-02-12 или 12.02.2026\n"
+            "Можно и период: 12.03–20.03, выходные, следующая неделя (добавь «по дням», чтобы разбить по дням)\n"
             "Также можно нажать кнопку ниже 👇",
             reply_markup=main_keyboard()
         )
@@ -805,7 +2450,7 @@ def handle(message):
         bot.reply_to(message, "Не удалось прочитать таблицу. Проверь доступ по ссылке.")
         return
 
-    matches = df[(df["start_date"] <= user_date) & (df["end_date"] >= user_date)]
+    count, blocks = exhibitions_on_date(df, user_date)
 
     try:
         bot.delete_message(message.chat.id, status.message_id)
@@ -814,7 +2459,7 @@ def handle(message):
 
     # === 6. Если ничего не найдено ===
 
-    if matches.empty:
+    if not count:
         bot.send_message(
             message.chat.id,
             "На эту дату выставок не найдено.",
@@ -825,8 +2470,8 @@ def handle(message):
     # === 7. Отправляем результат ===
 
     date_text = format_date_ddmmyyyy(user_date)
-    header_base = f"📅 Выставки на {date_text}\nНайдено: {len(matches)}"
-    send_matches(message.chat.id, matches, header_base)
+    header_base = f"📅 Выставки на {date_text}\nНайдено: {count}"
+    send_museum_chunks(message.chat.id, header_base, blocks)
 
 
 @bot.callback_query_handler(func=DetailedTelegramCalendar.func())
@@ -857,14 +2502,19 @@ def cal(callback_query):
             source="calendar"
         )
 
-        df = load_data_cached()
+        try:
+            df = load_data_cached()
+        except Exception:
+            bot.send_message(
+                callback_query.message.chat.id,
+                "Не удалось прочитать таблицу. Проверь доступ по ссылке.",
+                reply_markup=main_keyboard()
+            )
+            return
 
-        matches = df[
-            (df["start_date"] <= user_date) &
-            (df["end_date"] >= user_date)
-        ]
+        count, blocks = exhibitions_on_date(df, user_date)
 
-        if matches.empty:
+        if not count:
             bot.send_message(
                 callback_query.message.chat.id,
                 "На эту дату выставок не найдено.",
@@ -873,9 +2523,92 @@ def cal(callback_query):
             return
 
         date_text = user_date.strftime("%d.%m.%Y")
-        header_base = f"📅 Выставки на {date_text}\nНайдено: {len(matches)}"
+        header_base = f"📅 Выставки на {date_text}\nНайдено: {count}"
+
+        send_museum_chunks(callback_query.message.chat.id, header_base, blocks)
+
+
+# =======================
+# ПРЕДРАСЧЁТ НА ДЕНЬ
+# =======================
+# «Сегодня», «завтра», «выходные», «заканчиваются/начинаются скоро», «лучшие месяца» и «бесплатные дни»
+# зависят только от даты в Вене и от данных. Считаем их заранее — в полночь по Вене
+# и после каждого обновления таблиц, — и хендлеры просто берут готовое из общих результатов.
+# Заодно фоновый поток обновляет таблицы чуть раньше, чем истечёт кэш,
+# чтобы ни один запрос не ждал загрузки из Google.
+_materialize_wakeup = threading.Event()
+_materialized_at = None
+
+
+def _seconds_until_vienna_midnight():
+    now = datetime.now(TZ)
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=TZ)
+    return (midnight - now).total_seconds()
+
+
+def materialize_daily(refresh: bool = False):
+    global _materialized_at
+
+    today = vienna_today()
+    started = time.perf_counter()
+
+    try:
+        df = load_data_cached(force=refresh)
+    except Exception as e:
+        log_error("MATERIALIZE", e)
+        df = None
+
+    if df is not None:
+        exhibitions_on_date(df, today)
+        exhibitions_on_date(df, today + timedelta(days=1))
+        museum_blocks_on_date(df, today)
+        ending_soon_result(df, today)
+        starting_soon_result(df, today)
+        weekend_start, weekend_end, _ = parse_date_range("выходные")
+        exhibitions_in_range(df, weekend_start, weekend_end, by_day=True)
+        if "best" in df.columns:
+            best_month_result(df, today)
+
+    try:
+        free_df = load_free_days_cached(force=refresh)
+    except Exception as e:
+        log_error("MATERIALIZE", e)
+        free_df = None
+
+    if free_df is not None:
+        free_days_30_result(free_df, today)
+
+    _materialized_at = datetime.now(TZ)
+    log_event(
+        "materialize",
+        day=today.isoformat(),
+        refresh=refresh,
+        duration_ms=round((time.perf_counter() - started) * 1000, 1),
+    )
+
+
+def _materializer_loop():
+    next_refresh = 0.0
+    while True:
+        refresh = time.monotonic() >= next_refresh
+        if refresh:
+            next_refresh = time.monotonic() + CACHE_TTL_SECONDS * 0.9
+
+        try:
+            materialize_daily(refresh=refresh)
+        except Exception as e:
+            log_error("MATERIALIZE", e)
+
+        # проснёмся в полночь, к следующему обновлению или когда данные обновит кто-то ещё
+        timeout = min(_seconds_until_vienna_midnight() + 1, max(1.0, next_refresh - time.monotonic()))
+        _materialize_wakeup.wait(timeout)
+        _materialize_wakeup.clear()
+
 
-        send_matches(callback_query.message.chat.id, matches, header_base)
+def start_materializer():
+    threading.Thread(target=_materializer_loop, name="materializer", daemon=True).start()
 
 
-bot.polling()
\ No newline at end of file
+if __name__ == "__main__":
+    start_materializer()
+    bot.polling()
\ No newline at end of file
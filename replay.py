@@ -0,0 +1,298 @@
+"""
+Проигрывание записанного трафика (UPDATES_LOG_PATH) через настоящие хендлеры бота.
+
+Телеграм и Google Sheets подменяются локальными HTTP-серверами:
+- фейковый Bot API отвечает на sendMessage/editMessageText/... и, как настоящий,
+  отказывает в сообщениях длиннее 4096 символов (UTF-16, без учёта разметки);
+- таблицы отдаются из локальных CSV-файлов.
+
+Пример:
+    python replay.py updates.jsonl.1 updates.jsonl --sheet exhibitions.csv --free-sheet free.csv --speed 20
+"""
+import argparse
+import html
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Telegram считает длину в UTF-16 и после разбора HTML-разметки
+TELEGRAM_MAX_TEXT = 4096
+
+
+# =======================
+# ФЕЙКОВЫЙ BOT API
+# =======================
+class FakeBotApi:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.rejected = Counter()
+        self._message_id = 1000
+
+    def next_message_id(self):
+        with self.lock:
+            self._message_id += 1
+            return self._message_id
+
+    def handle(self, method, params):
+        with self.lock:
+            self.calls[method] += 1
+
+        text = params.get("text")
+        visible = text
+        if text is not None and params.get("parse_mode") == "HTML":
+            visible = html.unescape(re.sub(r"<[^>]*>", "", text))
+        if visible is not None and len(visible.encode("utf-16-le")) // 2 > TELEGRAM_MAX_TEXT:
+            with self.lock:
+                self.rejected[method] += 1
+            return 400, {"ok": False, "error_code": 400, "description": "Bad Request: message is too long"}
+
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = params.get("chat_id", "0")
+            result = {
+                "message_id": int(params.get("message_id") or self.next_message_id()),
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0, "type": "private"},
+                "text": text or "",
+            }
+            return 200, {"ok": True, "result": result}
+
+        return 200, {"ok": True, "result": True}
+
+
+def _make_api_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        def _serve(self):
+            parsed = urlparse(self.path)
+            method = parsed.path.rsplit("/", 1)[-1]
+            params = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                body = self.rfile.read(length).decode("utf-8", "replace")
+                params.update({k: v[-1] for k, v in parse_qs(body).items()})
+
+            status, payload = api.handle(method, params)
+            raw = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        do_GET = _serve
+        do_POST = _serve
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+# =======================
+# ЛОКАЛЬНЫЕ ТАБЛИЦЫ
+# =======================
+def _make_sheet_handler(sheet_path, free_sheet_path):
+    # основная вкладка отдаётся с gid=0, бот подставляет gid вкладки бесплатных дней
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            gid = parse_qs(urlparse(self.path).query).get("gid", ["0"])[-1]
+            path = sheet_path if gid == "0" else free_sheet_path
+            try:
+                with open(path, "rb") as f:
+                    raw = f.read()
+            except (OSError, TypeError):
+                self.send_response(404)
+                self.end_headers()
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv; charset=utf-8")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def _start_server(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# =======================
+# ЗАПУСК
+# =======================
+def load_records(paths):
+    # запись ротируется по размеру: можно передать и старые части (updates.jsonl.1, ...)
+    records = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[idx]
+
+
+def replay(records, speed, workers, bot_module):
+    import telebot
+    from telebot import apihelper
+
+    bot = bot_module.bot
+    bot.threaded = False  # хендлеры выполняются в наших воркерах — так меряем задержку
+
+    local = threading.local()
+    errors = Counter()
+    errors_lock = threading.Lock()
+
+    original_make_request = apihelper._make_request
+
+    def counting_make_request(*args, **kwargs):
+        local.api_calls = getattr(local, "api_calls", 0) + 1
+        return original_make_request(*args, **kwargs)
+
+    apihelper._make_request = counting_make_request
+
+    class CountingExceptionHandler(telebot.ExceptionHandler):
+        def handle(self, exception):
+            with errors_lock:
+                errors[type(exception).__name__] += 1
+            return True
+
+    bot.exception_handler = CountingExceptionHandler()
+
+    latencies = []
+    api_calls = []
+    results_lock = threading.Lock()
+
+    def run_one(update, scheduled_at):
+        local.api_calls = 0
+        try:
+            bot.process_new_updates([update])
+        except Exception as e:
+            with errors_lock:
+                errors[type(e).__name__] += 1
+        finally:
+            with results_lock:
+                latencies.append(time.perf_counter() - scheduled_at)
+                api_calls.append(local.api_calls)
+
+    first_ts = records[0]["ts"] if records else 0
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for update_id, record in enumerate(records, start=1):
+            scheduled_at = started + (record["ts"] - first_ts) / speed
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            update = telebot.types.Update.de_json({"update_id": update_id, record["type"]: record["payload"]})
+            pool.submit(run_one, update, scheduled_at)
+
+    elapsed = time.perf_counter() - started
+    apihelper._make_request = original_make_request
+
+    return {
+        "updates": len(records),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(len(records) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50) * 1000, 1),
+            "p95": round(_percentile(latencies, 95) * 1000, 1),
+            "p99": round(_percentile(latencies, 99) * 1000, 1),
+            "max": round(max(latencies, default=0) * 1000, 1),
+        },
+        "api_calls_per_update": {
+            "mean": round(sum(api_calls) / len(api_calls), 2) if api_calls else 0.0,
+            "max": max(api_calls, default=0),
+        },
+        "errors": dict(errors),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Проиграть записанные апдейты через хендлеры бота")
+    parser.add_argument("log", nargs="+", help="JSONL-файл(ы), записанные через UPDATES_LOG_PATH")
+    parser.add_argument("--sheet", required=True, help="CSV с выставками")
+    parser.add_argument("--free-sheet", help="CSV с бесплатными днями")
+    parser.add_argument("--speed", type=float, default=1.0, help="ускорение, 1–100")
+    parser.add_argument("--workers", type=int, default=2, help="параллельных обработчиков (как num_threads у TeleBot)")
+    parser.add_argument("--no-rate-limit", action="store_true", help="отключить лимиты на пользователя (при ускорении они срабатывают чаще, чем в жизни)")
+    parser.add_argument("--json", action="store_true", help="вывести отчёт в JSON")
+    args = parser.parse_args(argv)
+
+    if not 1 <= args.speed <= 100:
+        parser.error("--speed должен быть от 1 до 100")
+
+    records = load_records(args.log)
+
+    api = FakeBotApi()
+    api_server = _start_server(_make_api_handler(api))
+    sheet_server = _start_server(_make_sheet_handler(args.sheet, args.free_sheet))
+
+    # окружение бота — до импорта, он читает его при загрузке
+    tmp_dir = tempfile.mkdtemp(prefix="replay-")
+    os.environ["BOT_TOKEN"] = "0:replay"
+    os.environ["SHEETS_CSV_URL"] = f"http://127.0.0.1:{sheet_server.server_port}/export?format=csv&gid=0"
+    os.environ["STATS_PATH"] = os.path.join(tmp_dir, "stats.json")
+    os.environ.pop("UPDATES_LOG_PATH", None)
+    os.environ.setdefault("EVENTS_LOG_PATH", os.path.join(tmp_dir, "events.jsonl"))
+    # окно склейки повторных нажатий — в реальном времени: при ускорении нажатия,
+    # которые в записи шли через несколько секунд, иначе попадут в одно окно и отбросятся
+    dedup_seconds = float(os.environ.get("CALLBACK_DEDUP_SECONDS", "2"))
+    os.environ["CALLBACK_DEDUP_SECONDS"] = str(dedup_seconds / args.speed)
+    if args.no_rate_limit:
+        os.environ["RATE_LIMIT_PER_MINUTE"] = "1000000"
+        os.environ["RATE_LIMIT_BURST"] = "1000000"
+
+    from telebot import apihelper
+    apihelper.API_URL = f"http://127.0.0.1:{api_server.server_port}/bot{{0}}/{{1}}"
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import bot as bot_module
+    bot_module.start_materializer()  # как в проде: дневные выборки считаются в фоне
+
+    report = replay(records, args.speed, args.workers, bot_module)
+    report["api_calls_by_method"] = dict(api.calls)
+    report["api_rejected"] = dict(api.rejected)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        lat = report["latency_ms"]
+        print(f"Апдейтов: {report['updates']} за {report['elapsed_s']} с ({report['throughput_per_s']}/с)")
+        print(f"Задержка, мс: p50={lat['p50']} p95={lat['p95']} p99={lat['p99']} max={lat['max']}")
+        print(f"Вызовов API на апдейт: в среднем {report['api_calls_per_update']['mean']}, максимум {report['api_calls_per_update']['max']}")
+        print(f"Вызовы API: {report['api_calls_by_method']}")
+        print(f"Отклонено API: {report['api_rejected'] or 'нет'}")
+        print(f"Ошибки: {report['errors'] or 'нет'}")
+
+    api_server.shutdown()
+    sheet_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()